@@ -2,10 +2,11 @@
 import os
 import sqlite3
 import hashlib
-import uuid
+import secrets
+import base64
 import time
 from datetime import datetime, timedelta
-import json
+import orjson
 
 # ---------------- PATHS ----------------
 # Admin-only folder (plaintext keys + JSON)
@@ -21,8 +22,8 @@ SERVER_DB = os.path.join(BASE_DIR, "licenses.db")
 print("✅ Admin-only folder (you see plaintext keys here):", ADMIN_FOLDER)
 
 # ---------------- HELPERS ----------------
-def hash_key(key: str) -> str:
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+def hash_key(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
 
 def init_db(db_path: str):
     """Create table if it doesn't exist"""
@@ -32,7 +33,7 @@ def init_db(db_path: str):
     db.execute("""
         CREATE TABLE IF NOT EXISTS licenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key_hash TEXT NOT NULL UNIQUE,
+            key_hash BLOB NOT NULL UNIQUE,
             created_at INTEGER NOT NULL,
             expires_at INTEGER NOT NULL,
             activated_at INTEGER,
@@ -41,53 +42,82 @@ def init_db(db_path: str):
             metadata TEXT
         );
     """)
+    # Older DBs stored hex text; convert in place to 32-byte digests
+    db.create_function("hash_from_hex", 1, bytes.fromhex, deterministic=True)
+    db.execute("UPDATE licenses SET key_hash = hash_from_hex(key_hash) WHERE typeof(key_hash) = 'text'")
     db.commit()
     db.close()
 
-def store_hash(db_path: str, key_hash: str, days_valid: int = 30, metadata: str = None):
-    """Insert the hash into server DB"""
-    db = sqlite3.connect(db_path, timeout=30)
-    db.row_factory = sqlite3.Row
-    now = int(time.time())
-    expires = int((datetime.fromtimestamp(now) + timedelta(days=days_valid)).timestamp())
-    db.execute(
-        "INSERT OR IGNORE INTO licenses (key_hash, created_at, expires_at, metadata) VALUES (?, ?, ?, ?)",
-        (key_hash, now, expires, metadata)
-    )
-    db.commit()
-    db.close()
+def store_hashes(db_path: str, rows):
+    """Insert (key_hash, created_at, expires_at, metadata) rows in one transaction.
 
-def save_plain_key(plain_key: str):
-    """Save plaintext key locally (admin-only)"""
+    Returns the set of hashes that were not inserted because they already exist.
+    """
+    db = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM licenses").fetchone()[0]
+        cur = db.executemany(
+            "INSERT OR IGNORE INTO licenses (key_hash, created_at, expires_at, metadata) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        lost = set()
+        if cur.rowcount != len(rows):
+            inserted = {r[0] for r in db.execute("SELECT key_hash FROM licenses WHERE id > ?", (last_id,))}
+            lost = {r[0] for r in rows} - inserted
+        db.execute("COMMIT")
+        return lost
+    except Exception:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        raise
+    finally:
+        db.close()
+
+def save_plain_keys(plain_keys):
+    """Save plaintext keys locally (admin-only)"""
     try:
         os.makedirs(ADMIN_FOLDER, exist_ok=True)
-        with open(ADMIN_KEYS_FILE, "a", encoding="utf-8") as f:
-            f.write(plain_key.strip() + "\n")
+        with open(ADMIN_KEYS_FILE, "a", encoding="utf-8", buffering=1 << 20) as f:
+            f.writelines(k.strip() + "\n" for k in plain_keys)
+            # One flush + fsync for the whole batch; these keys can't be recovered
+            f.flush()
+            os.fsync(f.fileno())
     except Exception as e:
-        print("❌ Failed to write plaintext key:", e)
+        print("❌ Failed to write plaintext keys:", e)
 
 # ---------------- LICENSE GENERATION ----------------
-def generate_license(metadata=None, days_valid: int = 30):
-    for attempt in range(10):
-        raw = uuid.uuid4().hex.upper()
-        key = "-".join([raw[i:i+4] for i in range(0, 16, 4)])
-        key_hash = hash_key(key)
-        try:
-            # Store only hash in server DB
-            store_hash(SERVER_DB, key_hash, days_valid, metadata)
-            # Save plaintext locally (admin-only)
-            save_plain_key(key)
-            print(f"✅ Generated license (you see this): {key}")
-            return key
-        except sqlite3.IntegrityError:
-            if attempt == 9:
-                raise RuntimeError("Failed to generate unique license after 10 attempts")
-            continue
+def generate_keys(count: int):
+    """Build count plaintext keys (XXXX-XXXX-XXXX-XXXX) from one random buffer"""
+    # 10 random bytes encode to exactly 16 base32 chars (80 bits per key)
+    raw = base64.b32encode(secrets.token_bytes(10 * count)).decode("ascii")
+    return ["-".join((raw[i:i+4], raw[i+4:i+8], raw[i+8:i+12], raw[i+12:i+16])) for i in range(0, 16 * count, 16)]
+
+def license_period(days_valid: int = 30):
+    """Return (created_at, expires_at) for a license issued now"""
+    now = int(time.time())
+    return now, int((datetime.fromtimestamp(now) + timedelta(days=days_valid)).timestamp())
 
 def bulk_generate(total=1, days_valid=30, metadata=None):
     licenses = []
-    for _ in range(total):
-        licenses.append(generate_license(metadata, days_valid))
+    created, expires = license_period(days_valid)
+    for _ in range(10):
+        missing = total - len(licenses)
+        if missing <= 0:
+            break
+        # Keyed by hash so duplicates inside the batch collapse
+        pending = {hash_key(key): key for key in generate_keys(missing)}
+        # Store only hashes in server DB; colliding keys are regenerated next round
+        lost = store_hashes(SERVER_DB, [(h, created, expires, metadata) for h in pending])
+        stored = [key for h, key in pending.items() if h not in lost]
+        # Save plaintext locally (admin-only)
+        save_plain_keys(stored)
+        licenses.extend(stored)
+    if len(licenses) < total:
+        raise RuntimeError("Failed to generate unique licenses after 10 attempts")
+
+    for key in licenses:
+        print(f"✅ Generated license (you see this): {key}")
     return licenses
 
 # ---------------- MAIN ----------------
@@ -117,8 +147,8 @@ if __name__ == "__main__":
 
     # Save JSON locally (admin-only)
     try:
-        with open(ADMIN_JSON_FILE, "w", encoding="utf-8") as jf:
-            json.dump({"licenses": licenses, "days_valid": days_valid, "metadata": metadata}, jf, indent=4)
+        with open(ADMIN_JSON_FILE, "wb") as jf:
+            jf.write(orjson.dumps({"licenses": licenses, "days_valid": days_valid, "metadata": metadata}, option=orjson.OPT_INDENT_2))
         print(f"\nJSON saved to {ADMIN_JSON_FILE}")
     except Exception as e:
         print("❌ Failed to save JSON:", e)
@@ -0,0 +1,27 @@
+# license_admin/gunicorn.conf.py
+import os
+import sys
+
+# ---------------- SERVER ----------------
+bind = f"0.0.0.0:{os.environ.get('PORT', 5005)}"
+# SQLite calls block, so use real threads rather than gevent greenlets.
+# Each thread keeps its own connection (see get_db in server.py).
+worker_class = "gthread"
+# Rate-limit counters live in each worker unless RATELIMIT_STORAGE_URI points
+# at a shared store, and N workers would multiply every per-IP limit by N.
+rate_limits_shared = not os.environ.get("RATELIMIT_STORAGE_URI", "memory://").startswith("memory://")
+workers = int(os.environ.get("WEB_CONCURRENCY", 4 if rate_limits_shared else 1))
+if workers > 1 and not rate_limits_shared:
+    print(
+        f"⚠ WEB_CONCURRENCY={workers} ignored: rate limits use per-process memory storage. "
+        "Set RATELIMIT_STORAGE_URI (e.g. redis://localhost:6379/0) to run several workers.",
+        file=sys.stderr
+    )
+    workers = 1
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = 30
+
+# SSL is best terminated at the proxy (nginx/Caddy); these mirror server.py.
+if os.environ.get("USE_SSL", "0") == "1":
+    certfile = os.environ.get("SSL_CERT", "cert.pem")
+    keyfile = os.environ.get("SSL_KEY", "key.pem")
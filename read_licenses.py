@@ -2,6 +2,7 @@ import sqlite3
 import os
 from tabulate import tabulate
 from datetime import datetime, time as dt_time 
+from functools import lru_cache
 
 # ---------------- CONFIG ----------------
 # Possible database paths
@@ -17,6 +18,18 @@ if not db_file:
     print("⚠ No licenses database found!")
     exit()
 
+# ---------------- HELPERS ----------------
+@lru_cache(maxsize=4096)
+def fmt_date(ts):
+    # Bulk-generated licenses share timestamps, so most rows hit the cache
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+def fmt_hash(key_hash):
+    # Digests are stored as raw bytes; DBs not yet migrated still hold hex text
+    if isinstance(key_hash, bytes):
+        key_hash = key_hash.hex()
+    return key_hash[:10] + "..."
+
 # ---------------- CONNECT DB ----------------
 conn = sqlite3.connect(db_file)
 conn.row_factory = sqlite3.Row
@@ -54,25 +67,24 @@ query += " ORDER BY created_at DESC"
 
 # ---------------- FETCH AND DISPLAY ----------------
 try:
-    cur.execute(query, params)
-    rows = cur.fetchall()
+    # Format straight off the cursor so only one copy of the rows is held
+    formatted = [
+        [
+            row["id"],
+            fmt_hash(row["key_hash"]) if row["key_hash"] else None,
+            fmt_date(row["created_at"]),
+            fmt_date(row["expires_at"]),
+            fmt_date(row["activated_at"]) if row["activated_at"] else "Not activated",
+            row["activation_id"] or "None",
+            "Yes" if row["revoked"] else "No",
+            row["metadata"] or ""
+        ]
+        for row in cur.execute(query, params)
+    ]
 
-    if not rows:
+    if not formatted:
         print("\n📭 No licenses found for the selected criteria.")
     else:
-        formatted = []
-        for row in rows:
-            formatted.append([
-                row["id"],
-                row["key_hash"][:10] + "..." if row["key_hash"] else None,
-                datetime.fromtimestamp(row["created_at"]).strftime("%Y-%m-%d"),
-                datetime.fromtimestamp(row["expires_at"]).strftime("%Y-%m-%d"),
-                datetime.fromtimestamp(row["activated_at"]).strftime("%Y-%m-%d") if row["activated_at"] else "Not activated",
-                row["activation_id"] or "None",
-                "Yes" if row["revoked"] else "No",
-                row["metadata"] or ""
-            ])
-
         print("\n📌 LICENSE DATABASE CONTENTS\n")
         print(tabulate(formatted, headers=[
             "ID", "Key Hash", "Created", "Expires", "Activated",
@@ -2,14 +2,20 @@
 import os
 import sqlite3
 import hashlib
+import hmac
 import uuid
 import time
+import threading
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+import orjson
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address 
 import logging  
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import queue
+import atexit
 
 # ---------------- CONFIG ----------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,15 +24,43 @@ PORT = int(os.environ.get("PORT", 5005))
 USE_SSL = os.environ.get("USE_SSL", "0") == "1"
 SSL_CERT = os.environ.get("SSL_CERT", "cert.pem")
 SSL_KEY = os.environ.get("SSL_KEY", "key.pem")
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "change-me")
+# The default secret is public, so it must never lift rate limits
+ADMIN_SECRET_CONFIGURED = "ADMIN_SECRET" in os.environ
+# Shared store so limits hold across gunicorn workers, e.g. redis://localhost:6379/0
+RATELIMIT_STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
+LIST_PAGE_SIZE = 100
+LIST_PAGE_MAX = 1000
+# Shared by /validate_license and /validate_batch (charged per license)
+VALIDATE_LIMIT = "10 per minute"
+# A public batch can't exceed one minute's validate budget; callers exempt
+# from rate limits (ADMIN_SECRET set) may send fleet-sized batches
+BATCH_MAX = 10
+BATCH_MAX_EXEMPT = 100
 
 # ---------------- FLASK ----------------
 app = Flask(__name__)
 
 # ---------------- RATE LIMITING ----------------
+def constant_time_equals(a, b):
+    """Compare two strings without leaking where they differ through timing."""
+    return hmac.compare_digest((a or "").encode("utf-8"), (b or "").encode("utf-8"))
+
+def is_admin_request():
+    return constant_time_equals(request.headers.get("X-ADMIN-SECRET"), ADMIN_SECRET)
+
+def is_rate_limit_exempt():
+    return ADMIN_SECRET_CONFIGURED and is_admin_request()
+
 # Updated for Flask-Limiter v2+ API
 limiter = Limiter(
     key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    default_limits=["200 per day", "50 per hour"],
+    default_limits_exempt_when=is_rate_limit_exempt,
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy="fixed-window",
+    # Keep limiting per process if the shared store goes down
+    in_memory_fallback_enabled=True
 )
 limiter.init_app(app) #link limiter to app
 
@@ -35,21 +69,39 @@ LOG_FILE = os.path.join(BASE_DIR, "license_server.log")
 handler = RotatingFileHandler(LOG_FILE, maxBytes=5*1024*1024, backupCount=5)
 formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
 handler.setFormatter(formatter)
-app.logger.addHandler(handler)
+# Request threads only enqueue records; a background thread does the file I/O
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+app.logger.addHandler(QueueHandler(log_queue))
 app.logger.setLevel(logging.INFO)
 
 # ---------------- DATABASE ----------------
+# One connection per thread, reused across requests
+_local = threading.local()
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Per-connection settings; journal_mode=WAL is persisted by init_db
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
+        _local.conn = conn
     return conn
 
 def init_db():
     db = get_db()
+    # WAL lets readers run alongside the writer; the setting sticks to the DB file
+    db.execute("PRAGMA journal_mode=WAL")
     db.execute("""
         CREATE TABLE IF NOT EXISTS licenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key_hash TEXT NOT NULL UNIQUE,
+            key_hash BLOB NOT NULL UNIQUE,
             created_at INTEGER NOT NULL,
             expires_at INTEGER NOT NULL,
             activated_at INTEGER,
@@ -58,74 +110,329 @@ def init_db():
             metadata TEXT
         );
     """)
+    # Older DBs stored hex text; convert in place to 32-byte digests
+    db.create_function("hash_from_hex", 1, bytes.fromhex, deterministic=True)
+    db.execute("UPDATE licenses SET key_hash = hash_from_hex(key_hash) WHERE typeof(key_hash) = 'text'")
     db.commit()
-    db.close()
+    refresh_known_keys()
+    start_known_keys_refresher()
+
+# ---------------- VALIDATION CACHE ----------------
+# key_hash -> (installation_id, expires_at) for licenses that validated OK.
+# Only successes are cached so guessed keys can't fill it up.
+_valid_cache = TTLCache(maxsize=10_000, ttl=60)
+_valid_cache_lock = threading.Lock()
+
+def get_cached_validation(k_hash, install_id):
+    """Return the cached expires_at if this device recently validated k_hash."""
+    with _valid_cache_lock:
+        entry = _valid_cache.get(k_hash)
+    if entry is not None and constant_time_equals(entry[0], install_id):
+        return entry[1]
+    return None
+
+def cache_validation(k_hash, install_id, expires_at):
+    with _valid_cache_lock:
+        _valid_cache[k_hash] = (install_id, expires_at)
+
+def invalidate_validation(k_hash):
+    with _valid_cache_lock:
+        _valid_cache.pop(k_hash, None)
+
+# ---------------- KNOWN-KEY FILTER ----------------
+# Bloom filter of every issued key_hash so guessed keys are rejected from
+# memory. Digests are already uniformly random, so the probe positions are
+# simply 24-bit slices of the digest. Keys are issued by generate_license.py
+# in another process; a background thread picks them up every
+# KNOWN_KEYS_REFRESH seconds, so a brand-new key can be refused for that long.
+KNOWN_KEYS_PROBES = 7
+KNOWN_KEYS_MASK = (1 << 24) - 1  # 2MB of bits, ~6e-4 false positives at 1M keys
+KNOWN_KEYS_REFRESH = 2.0  # seconds
+_known_keys = bytearray((KNOWN_KEYS_MASK + 1) // 8)
+_known_keys_lock = threading.Lock()
+_known_keys_last_id = 0
+_known_keys_refresher = None
+_known_keys_loaded = False
+
+def refresh_known_keys():
+    global _known_keys_last_id, _known_keys_loaded
+    with _known_keys_lock:
+        rows = get_db().execute(
+            "SELECT id, key_hash FROM licenses WHERE id > ? ORDER BY id", (_known_keys_last_id,)
+        ).fetchall()
+        for row in rows:
+            key_hash = row["key_hash"]
+            if isinstance(key_hash, str):
+                # Hex row not migrated by init_db yet
+                try:
+                    key_hash = bytes.fromhex(key_hash)
+                except ValueError:
+                    continue
+            n = int.from_bytes(key_hash[:3 * KNOWN_KEYS_PROBES], "big")
+            for _ in range(KNOWN_KEYS_PROBES):
+                bit = n & KNOWN_KEYS_MASK
+                _known_keys[bit >> 3] |= 1 << (bit & 7)
+                n >>= 24
+        if rows:
+            _known_keys_last_id = rows[-1]["id"]
+        _known_keys_loaded = True
+
+def _refresh_known_keys_forever():
+    while True:
+        time.sleep(KNOWN_KEYS_REFRESH)
+        try:
+            refresh_known_keys()
+        except Exception as e:
+            app.logger.error("Known-key refresh failed: %s", str(e))
+
+def start_known_keys_refresher():
+    global _known_keys_refresher
+    with _known_keys_lock:
+        if _known_keys_refresher is None:
+            _known_keys_refresher = threading.Thread(target=_refresh_known_keys_forever, daemon=True)
+            _known_keys_refresher.start()
+
+def may_be_issued(k_hash):
+    """False only if k_hash was never issued (as of the last refresh)."""
+    if not _known_keys_loaded:
+        # App served without init_db(): load on first use, and let the DB
+        # lookup decide until the filter has been filled once
+        try:
+            refresh_known_keys()
+            start_known_keys_refresher()
+        except Exception as e:
+            app.logger.error("Known-key load failed: %s", str(e))
+            return True
+    n = int.from_bytes(k_hash[:3 * KNOWN_KEYS_PROBES], "big")
+    for _ in range(KNOWN_KEYS_PROBES):
+        bit = n & KNOWN_KEYS_MASK
+        if not _known_keys[bit >> 3] >> (bit & 7) & 1:
+            return False
+        n >>= 24
+    return True
 
 # ---------------- HELPERS ----------------
-def hash_key(key: str):
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()
-
-def get_license_row_by_hash(k_hash):
-    with get_db() as db:
-        return db.execute("SELECT * FROM licenses WHERE key_hash=?", (k_hash,)).fetchone()
-
-def activate_license(k_hash, install_id):
-    now = int(time.time())
-    with get_db() as db:
-        db.execute(
-            "UPDATE licenses SET activated_at=?, activation_id=? WHERE key_hash=?",
-            (now, install_id, k_hash)
+def hash_key(key: str) -> bytes:
+    # Must match generate_license.py; hashlib's OpenSSL backend uses SHA-NI when available
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+def activate_or_fetch(k_hash, install_id, now):
+    """Return (row, activated) for k_hash, claiming the license for install_id if unclaimed.
+
+    The UPDATE only matches a live, unclaimed license, so two devices racing
+    on the same key can't both activate it. Repeat validations stay read-only.
+    """
+    db = get_db()
+    row = db.execute("SELECT * FROM licenses WHERE key_hash=?", (k_hash,)).fetchone()
+    if row is None or row["activation_id"] is not None or row["revoked"] or now > row["expires_at"]:
+        return row, False
+
+    invalidate_validation(k_hash)
+    with db:
+        claimed = db.execute(
+            "UPDATE licenses SET activated_at=?, activation_id=? "
+            "WHERE key_hash=? AND activation_id IS NULL AND revoked=0 AND expires_at>=? RETURNING *",
+            (now, install_id, k_hash, now)
+        ).fetchall()
+    if claimed:
+        return claimed[0], True
+
+    # Another request claimed it first; report the current state
+    return db.execute("SELECT * FROM licenses WHERE key_hash=?", (k_hash,)).fetchone(), False
+
+def activate_or_fetch_many(pairs, now):
+    """Batch form of activate_or_fetch for a list of (k_hash, install_id) pairs.
+
+    One SELECT covers every key and one executemany claims the unclaimed
+    ones; the first pair asking for an unclaimed key gets it. Returns a
+    (row, activated) tuple per pair, in order.
+    """
+    db = get_db()
+    hashes = list({k_hash for k_hash, _ in pairs})
+    rows = {r["key_hash"]: r for r in db.execute(
+        f"SELECT * FROM licenses WHERE key_hash IN ({','.join('?' * len(hashes))})", hashes
+    )}
+
+    claims = {}
+    for k_hash, install_id in pairs:
+        row = rows.get(k_hash)
+        if row is not None and row["activation_id"] is None and not row["revoked"] and now <= row["expires_at"]:
+            claims.setdefault(k_hash, install_id)
+
+    if claims:
+        for k_hash in claims:
+            invalidate_validation(k_hash)
+        with db:
+            db.executemany(
+                "UPDATE licenses SET activated_at=?, activation_id=? "
+                "WHERE key_hash=? AND activation_id IS NULL AND revoked=0 AND expires_at>=?",
+                [(now, install_id, k_hash, now) for k_hash, install_id in claims.items()]
+            )
+        # Re-read the claimed rows; a concurrent request may have won some of them
+        rows.update({r["key_hash"]: r for r in db.execute(
+            f"SELECT * FROM licenses WHERE key_hash IN ({','.join('?' * len(claims))})", list(claims)
+        )})
+
+    results = []
+    for k_hash, install_id in pairs:
+        row = rows.get(k_hash)
+        activated = (
+            k_hash in claims and claims[k_hash] == install_id and row["activated_at"] == now
+            and constant_time_equals(row["activation_id"], install_id)
         )
-        db.commit()
+        if activated:
+            # Later pairs for the same key see it as already activated
+            del claims[k_hash]
+        results.append((row, activated))
+    return results
+
+# ---------------- CANNED RESPONSES ----------------
+# Fixed validate outcomes, serialized once at import
+def _canned(message, status):
+    return orjson.dumps({"success": False, "message": message}), status
+
+MISSING_LICENSE = _canned("Missing license.", 400)
+INVALID_LICENSE = _canned("Invalid license.", 403)
+REVOKED_LICENSE = _canned("License revoked.", 403)
+EXPIRED_LICENSE = _canned("License expired.", 403)
+LICENSE_IN_USE = _canned("License already used on another device.", 403)
+
+MISSING_LICENSES = _canned("Missing licenses.", 400)
+BATCH_TOO_LARGE = _canned(f"At most {BATCH_MAX} licenses per batch.", 400)
+BATCH_TOO_LARGE_EXEMPT = _canned(f"At most {BATCH_MAX_EXEMPT} licenses per batch.", 400)
+TOO_MANY_REQUESTS = _canned("Too many requests. Please try again later.", 429)
+
+def _success(message, expires_at):
+    return orjson.dumps({"success": True, "message": message, "expires_at": expires_at}), 200
+
+def json_response(result):
+    body, status = result
+    return Response(body, status=status, mimetype="application/json")
+
+def validation_result(k_hash, install_id, row, activated, now):
+    """Turn a looked-up license into a (body, status) outcome, caching successes."""
+    if row is None :
+        return INVALID_LICENSE
+
+    if row["revoked"]:
+        return REVOKED_LICENSE
+
+    if row["expires_at"] and now > row["expires_at"]:
+        return EXPIRED_LICENSE
+
+    # First activation
+    if activated:
+        message = "License activated."
+    # Same device reuse
+    elif constant_time_equals(row["activation_id"], install_id):
+        message = "Welcome back!"
+    # Different device
+    else:
+        return LICENSE_IN_USE
+
+    cache_validation(k_hash, install_id, row["expires_at"])
+    return _success(message, row["expires_at"])
 
 # ---------------- ROUTES ----------------
+@app.before_request
+def set_request_time():
+    # One wall-clock read per request, shared by every expiry check
+    g.now = int(time.time())
+
 @app.route("/validate_license", methods=["POST"])
-@limiter.limit("10 per minute")
+@limiter.shared_limit(VALIDATE_LIMIT, scope="validate", exempt_when=is_rate_limit_exempt)
 def validate_license():
     data = request.get_json() or {}
     license_key = (data.get("license") or "").strip()
     install_id = (data.get("installation_id") or "").strip()
 
     if not license_key:
-        return jsonify({"success": False, "message": "Missing license."}), 400
+        return json_response(MISSING_LICENSE)
 
     k_hash = hash_key(license_key)
-    row = get_license_row_by_hash(k_hash)
+    now = g.now
 
-    if row is None :
-        return jsonify({"success": False, "message": "Invalid license."}), 403
+    # Repeat validation from the same device within the cache TTL
+    expires_at = get_cached_validation(k_hash, install_id)
+    if expires_at is not None and now <= expires_at:
+        return json_response(_success("Welcome back!", expires_at))
 
-    if row["revoked"]:
-        return jsonify({"success": False, "message": "License revoked."}), 403
+    if not may_be_issued(k_hash):
+        return json_response(INVALID_LICENSE)
 
-    now = int(time.time())
-    if row["expires_at"] and now > row["expires_at"]:
-        return jsonify({"success": False, "message": "License expired."}), 403
+    row, activated = activate_or_fetch(k_hash, install_id, now)
+    return json_response(validation_result(k_hash, install_id, row, activated, now))
 
-    # First activation
-    if row["activation_id"] is None :
-        activate_license(k_hash, install_id)
-        return jsonify({"success": True, "message": "License activated.", "expires_at": row["expires_at"]})
+def batch_items():
+    data = request.get_json(silent=True)
+    items = data.get("licenses") if isinstance(data, dict) else None
+    return items if isinstance(items, list) else None
 
-    # Same device reuse
-    if row["activation_id"] == install_id:
-        return jsonify({"success": True, "message": "Welcome back!", "expires_at": row["expires_at"]})
+def batch_cost():
+    # Each license in a batch counts as one validation against the limit;
+    # oversized batches are refused by the route, so they cost one request
+    items = batch_items()
+    return len(items) if items and len(items) <= BATCH_MAX else 1
 
-    # Different device
-    return jsonify({"success": False, "message": "License already used on another device."}), 403
+@app.route("/validate_batch", methods=["POST"])
+@limiter.shared_limit(VALIDATE_LIMIT, scope="validate", exempt_when=is_rate_limit_exempt, cost=batch_cost)
+def validate_batch():
+    # {"licenses": [{"license": ..., "installation_id": ...}, ...]} -> results in the same order
+    items = batch_items()
+    if not items:
+        return json_response(MISSING_LICENSES)
+    if is_rate_limit_exempt():
+        if len(items) > BATCH_MAX_EXEMPT:
+            return json_response(BATCH_TOO_LARGE_EXEMPT)
+    elif len(items) > BATCH_MAX:
+        return json_response(BATCH_TOO_LARGE)
+
+    now = g.now
+    bodies = [MISSING_LICENSE[0]] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        license_key = (item.get("license") or "").strip()
+        install_id = (item.get("installation_id") or "").strip()
+        if license_key:
+            pending.append((i, hash_key(license_key), install_id))
+
+    if pending:
+        found = activate_or_fetch_many([(k_hash, install_id) for _, k_hash, install_id in pending], now)
+        for (i, k_hash, install_id), (row, activated) in zip(pending, found):
+            bodies[i] = validation_result(k_hash, install_id, row, activated, now)[0]
+
+    # Outcome bodies are already serialized; splice them into the envelope
+    return Response(b'{"success":true,"results":[' + b",".join(bodies) + b"]}", mimetype="application/json")
 
 @app.route("/list_licenses", methods=["GET"])
 def list_licenses():
     # Optional admin-only endpoint (protect with a secret in headers)
-    ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "change-me")
-    if request.headers.get("X-ADMIN-SECRET") != ADMIN_SECRET:
+    if not is_admin_request():
         return jsonify({"success": False, "message": "Unauthorized"}), 401
 
-    with get_db() as db:
-        rows = db.execute("SELECT id, key_hash, created_at, expires_at, activated_at, activation_id, revoked, metadata FROM licenses").fetchall()
-        return jsonify({"success": True, "licenses": [dict(r) for r in rows]})
+    # Keyset pagination: ?after_id=<last id seen>&limit=<page size>
+    try:
+        after_id = int(request.args.get("after_id", 0))
+        limit = min(max(int(request.args.get("limit", LIST_PAGE_SIZE)), 1), LIST_PAGE_MAX)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid pagination parameters."}), 400
+
+    rows = get_db().execute(
+        "SELECT id, lower(hex(key_hash)) AS key_hash, created_at, expires_at, activated_at, activation_id, revoked, metadata "
+        "FROM licenses WHERE id > ? ORDER BY id LIMIT ?",
+        (after_id, limit)
+    ).fetchall()
+    licenses = [dict(r) for r in rows]
+    next_after_id = licenses[-1]["id"] if len(licenses) == limit else None
+    body = orjson.dumps({"success": True, "licenses": licenses, "next_after_id": next_after_id})
+    return Response(body, mimetype="application/json")
 
 # ---------------- ERROR HANDLER ----------------
+@app.errorhandler(429)
+def handle_rate_limit(e):
+    return json_response(TOO_MANY_REQUESTS)
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     app.logger.error("Unexpected error: %s", str(e))
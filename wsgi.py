@@ -0,0 +1,5 @@
+# license_admin/wsgi.py
+# Production entrypoint: gunicorn wsgi:app (settings in gunicorn.conf.py)
+from server import app, init_db
+
+init_db()